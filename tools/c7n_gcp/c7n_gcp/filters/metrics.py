@@ -3,8 +3,11 @@
 """
 Monitoring Metrics suppport for resources
 """
-from datetime import datetime, timedelta
-import pytz
+from datetime import datetime, timedelta, timezone
+import functools
+import operator
+import re
+import time
 
 import jmespath
 
@@ -13,12 +16,11 @@ from c7n.utils import local_session, type_schema
 
 from c7n_gcp.provider import resources as gcp_resources
 
-REDUCERS = [
+REDUCERS = (
     'REDUCE_NONE',
     'REDUCE_MEAN',
     'REDUCE_MIN',
     'REDUCE_MAX',
-    'REDUCE_MEAN',
     'REDUCE_SUM',
     'REDUCE_STDDEV',
     'REDUCE_COUNT',
@@ -28,9 +30,9 @@ REDUCERS = [
     'REDUCE_PERCENTILE_99',
     'REDUCE_PERCENTILE_95',
     'REDUCE_PERCENTILE_50',
-    'REDUCE_PERCENTILE_05']
+    'REDUCE_PERCENTILE_05')
 
-ALIGNERS = [
+ALIGNERS = (
     'ALIGN_NONE',
     'ALIGN_DELTA',
     'ALIGN_RATE',
@@ -40,7 +42,6 @@ ALIGNERS = [
     'ALIGN_MEAN',
     'ALIGN_COUNT',
     'ALIGN_SUM',
-    'REDUCE_COUNT_FALSE',
     'ALIGN_STDDEV',
     'ALIGN_COUNT_TRUE',
     'ALIGN_COUNT_FALSE',
@@ -49,10 +50,24 @@ ALIGNERS = [
     'ALIGN_PERCENTILE_95',
     'ALIGN_PERCENTILE_50',
     'ALIGN_PERCENTILE_05',
-    'ALIGN_PERCENT_CHANG']
+    'ALIGN_PERCENT_CHANGE')
 
 BATCH_SIZE = 10000
 
+SIMPLE_KEY = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+@functools.lru_cache(maxsize=256)
+def _make_getter(key):
+    """Return a callable extracting ``key`` from a dict.
+
+    Plain identifiers are resolved with a direct dict lookup, anything
+    else is treated as a jmespath expression.
+    """
+    if SIMPLE_KEY.fullmatch(key):
+        return operator.methodcaller('get', key)
+    return jmespath.compile(key).search
+
 
 class GCPMetricsFilter(Filter):
     """Supports metrics filters on resources.
@@ -89,8 +104,8 @@ class GCPMetricsFilter(Filter):
           'group-by-fields': {'type': 'array', 'items': {'type': 'string'}},
           'days': {'type': 'number'},
           'op': {'type': 'string', 'enum': list(OPERATORS.keys())},
-          'reducer': {'type': 'string', 'enum': REDUCERS},
-          'aligner': {'type': 'string', 'enum': ALIGNERS},
+          'reducer': {'type': 'string', 'enum': list(REDUCERS)},
+          'aligner': {'type': 'string', 'enum': list(ALIGNERS)},
           'value': {'type': 'number'},
           'filter': {'type': 'string'},
           'missing-value': {'type': 'number'},
@@ -115,41 +130,50 @@ class GCPMetricsFilter(Filter):
         self.reducer = self.data.get('reducer', 'REDUCE_NONE')
         self.group_by_fields = self.data.get('group-by-fields', [])
         self.missing_value = self.data.get('missing-value')
-        self.end = datetime.now(pytz.timezone('UTC'))
+        self.end = datetime.now(timezone.utc)
         self.start = self.end - duration
-        self.period = str((self.end - self.start).total_seconds()) + 's'
+        self.period = '{}s'.format(int(duration.total_seconds()))
         self.resource_metric_dict = {}
         self.op = OPERATORS[self.data.get('op', 'less-than')]
         self.value = self.data['value']
         self.filter = self.data.get('filter', '')
         self.c7n_metric_key = "%s.%s.%s" % (self.metric, self.aligner, self.reducer)
+        self._resource_getter = _make_getter(self.resource_key)
+        self._metric_getter = _make_getter(self.metric_key)
+
+        if not resources:
+            return []
 
         session = local_session(self.manager.session_factory)
         client = session.client("monitoring", "v3", "projects.timeSeries")
         project = session.get_default_project()
 
-        time_series_data = []
-        for batched_filter in self.get_batched_query_filter(resources):
-            query_params = {
-                'filter': batched_filter,
-                'interval_startTime': self.start.isoformat(),
-                'interval_endTime': self.end.isoformat(),
-                'aggregation_alignmentPeriod': self.period,
-                "aggregation_perSeriesAligner": self.aligner,
-                "aggregation_crossSeriesReducer": self.reducer,
-                "aggregation_groupByFields": self.group_by_fields,
-                'view': 'FULL'
-            }
-            metric_list = client.execute_query('list',
-                {'name': 'projects/' + project, **query_params})
-            time_series_data.extend(metric_list.get('timeSeries', []))
-
-        if not time_series_data:
-            self.log.info("No metrics found for {}".format(self.c7n_metric_key))
+        query_params = {
+            'name': 'projects/' + project,
+            'interval_startTime': self.start.isoformat(),
+            'interval_endTime': self.end.isoformat(),
+            'aggregation_alignmentPeriod': self.period,
+            "aggregation_perSeriesAligner": self.aligner,
+            "aggregation_crossSeriesReducer": self.reducer,
+            "aggregation_groupByFields": self.group_by_fields,
+            'view': 'FULL'
+        }
+        batched_filters = self.get_batched_query_filter(resources)
+        cache_key = self.get_cache_key(project, batched_filters)
+        results = self.get_cached_time_series(cache_key)
+        if results is None:
+            results = self.get_batched_time_series(
+                client, [{**query_params, 'filter': f} for f in batched_filters])
+            self.manager._cache.save(cache_key, (time.time(), results))
+        for time_series in results:
+            self.split_by_resource(time_series)
+
+        if not self.resource_metric_dict:
+            self.log.info("No metrics found for %s", self.c7n_metric_key)
             return []
 
-        self.split_by_resource(time_series_data)
-        matched = [r for r in resources if self.process_resource(r)]
+        match = self._make_matcher()
+        matched = [r for r in resources if match(r)]
 
         return matched
 
@@ -161,21 +185,21 @@ class GCPMetricsFilter(Filter):
 
         resource_filter = []
         batch_size = len(self.filter)
-        for r in resources:
-            resource_name = jmespath.search(self.resource_key, r)
+        # dedupe names while keeping resource order stable
+        resource_names = dict.fromkeys(map(self._resource_getter, resources))
+        resource_names.pop(None, None)
+        for resource_name in resource_names:
             resource_filter_item = '{} = "{}"'.format(self.metric_key, resource_name)
             resource_filter.append(resource_filter_item)
-            resource_filter.append(' OR ')
             batch_size += len(resource_filter_item) + 4
 
             if batch_size >= BATCH_SIZE:
-                resource_filter.pop()
                 batched_resources.append(resource_filter)
                 resource_filter = []
                 batch_size = len(self.filter)
 
-        resource_filter.pop()
-        batched_resources.append(resource_filter)
+        if resource_filter:
+            batched_resources.append(resource_filter)
         return batched_resources
 
     def get_batched_query_filter(self, resources):
@@ -188,33 +212,77 @@ class GCPMetricsFilter(Filter):
         for batch in self.batch_resources(resources):
             batched_filters.append(''.join([
                 metric_filter_type,
-                ''.join(batch),
+                ' OR '.join(batch),
                 ' ) ',
                 user_filter
             ]))
         return batched_filters
 
-    def split_by_resource(self, metric_list):
-        for m in metric_list:
-            resource_name = jmespath.search(self.metric_key, m)
-            self.resource_metric_dict[resource_name] = m
-
-    def process_resource(self, resource):
-        resource_metric = resource.setdefault('c7n.metrics', {})
+    def get_cache_key(self, project, batched_filters):
+        # The batched filters carry the metric type, resource names and user
+        # filter. The interval is left out because entries expire with the
+        # cache period instead.
+        return {'source_type': 'gcp-metrics',
+                'project': project,
+                'filters': tuple(batched_filters),
+                'period': self.period,
+                'aligner': self.aligner,
+                'reducer': self.reducer,
+                'group_by_fields': tuple(self.group_by_fields)}
+
+    def get_cached_time_series(self, cache_key):
+        if not self.manager._cache.load():
+            return None
+        cached = self.manager._cache.get(cache_key)
+        if cached is None:
+            return None
+        fetched_at, results = cached
+        if time.time() - fetched_at > self.manager.config.cache_period * 60:
+            return None
+        return results
+
+    def get_batched_time_series(self, client, batched_params):
+        # Most calls produce a single batch. Only start worker threads
+        # when there are several queries to overlap.
+        if len(batched_params) <= 1:
+            return [self.get_time_series(client, params) for params in batched_params]
+        with self.executor_factory(max_workers=3) as w:
+            return list(w.map(functools.partial(self.get_time_series, client), batched_params))
+
+    def get_time_series(self, client, query_params):
+        time_series = []
+        for page in client.execute_paged_query('list', query_params):
+            time_series.extend(page.get('timeSeries', []))
+        return time_series
 
-        resource_name = jmespath.search(self.resource_key, resource)
-        metric = self.resource_metric_dict.get(resource_name)
-        if not metric and not self.missing_value:
-            return False
-        if not metric:
-            metric_value = self.missing_value
-        else:
-            metric_value = float(list(metric["points"][0]["value"].values())[0])
-
-        resource_metric[self.c7n_metric_key] = metric
-
-        matched = self.op(metric_value, self.value)
-        return matched
+    def split_by_resource(self, metric_list):
+        get_resource_name = self._metric_getter
+        self.resource_metric_dict.update((get_resource_name(m), m) for m in metric_list)
+
+    def _make_matcher(self):
+        op, value, missing_value = self.op, self.value, self.missing_value
+        get_resource_name = self._resource_getter
+        get_metric = self.resource_metric_dict.get
+        c7n_metric_key = self.c7n_metric_key
+
+        def match(resource):
+            metric = get_metric(get_resource_name(resource))
+            if not metric:
+                # no time series for this resource, leave it unannotated
+                if not missing_value:
+                    return False
+                return op(missing_value, value)
+
+            resource_metric = resource.get('c7n.metrics')
+            if resource_metric is None:
+                resource_metric = resource['c7n.metrics'] = {}
+            resource_metric[c7n_metric_key] = metric
+            # doubleValue arrives as a number, int64Value as a string
+            metric_value = next(iter(metric["points"][0]["value"].values()))
+            if not isinstance(metric_value, (int, float)):
+                metric_value = float(metric_value)
+            return op(metric_value, value)
+        return match
 
     @classmethod
     def register_resources(klass, registry, resource_class):
@@ -3,6 +3,9 @@
 """
 Security Command Center Findings suppport for GCP resources
 """
+from collections import defaultdict
+import time
+
 from c7n.filters.core import ValueFilter
 from c7n.utils import local_session, type_schema
 from c7n_gcp.provider import resources as gcp_resources
@@ -29,53 +32,66 @@ class SecurityComandCenterFindingsFilter(ValueFilter):
     annotation_key = 'c7n:matched-findings'
 
     def process(self, resources, event=None):
+        if not resources:
+            return []
+        self._name_attr = self.manager.resource_type.name
+        self.findings_by_resource = defaultdict(list)
         if not resources[0].get(self.annotation_key):
-            findings_list = self.get_findings(resources)
-            self.split_by_resource(findings_list)
+            resource_filter = self.get_resource_filter(resources)
+            cache_key = {'source_type': 'scc-findings',
+                         'org': self.data['org'],
+                         'filter': resource_filter}
+            cached = self.get_cached_findings(cache_key)
+            if cached is not None:
+                # copy so annotations never alias the cached findings
+                self.findings_by_resource = {k: list(v) for k, v in cached.items()}
+            else:
+                self.split_by_resource(self.get_findings(resource_filter))
+                self.manager._cache.save(cache_key, (time.time(), {
+                    k: tuple(v) for k, v in self.findings_by_resource.items()}))
         matched = [r for r in resources if self.process_resource(r)]
         return matched
 
-    def get_findings(self, resources):
-        self.findings_by_resource = {}
+    def get_cached_findings(self, cache_key):
+        if not self.manager._cache.load():
+            return None
+        cached = self.manager._cache.get(cache_key)
+        if cached is None:
+            return None
+        fetched_at, findings_by_resource = cached
+        if time.time() - fetched_at > self.manager.config.cache_period * 60:
+            return None
+        return findings_by_resource
+
+    def get_findings(self, resource_filter):
         query_params = {
-            'filter': self.get_resource_filter(resources),
+            'filter': resource_filter,
             'pageSize': 1000
         }
         session = local_session(self.manager.session_factory)
         client = session.client("securitycenter", "v1", "organizations.sources.findings")
-        findings_paged_list = list(client.execute_paged_query('list',
-            {'parent': 'organizations/{}/sources/-'.format(self.data['org']), **query_params}))
-        findings_list = []
-        for findings_page in findings_paged_list:
-            if findings_page.get('listFindingsResults'):
-                findings_list.extend(findings_page['listFindingsResults'])
-        return findings_list
+        for findings_page in client.execute_paged_query('list',
+                {'parent': 'organizations/{}/sources/-'.format(self.data['org']), **query_params}):
+            yield from findings_page.get('listFindingsResults', ())
 
     def get_resource_filter(self, resources):
-        resource_filter = []
-        for r in resources:
-            resource_filter.append('resourceName:"{}"'.format(r[self.manager.resource_type.name]))
-            resource_filter.append(' OR ')
-        resource_filter.pop()
-
-        return ''.join(resource_filter)
+        name_attr = self._name_attr
+        return ' OR '.join('resourceName:"{}"'.format(r[name_attr]) for r in resources)
 
     def split_by_resource(self, finding_list):
         for f in finding_list:
-            resource_name = f["finding"]["resourceName"].split('/')[-1]
-            resource_findings = self.findings_by_resource.get(resource_name, [])
-            resource_findings.append(f['finding'])
-            self.findings_by_resource[resource_name] = resource_findings
+            resource_name = f["finding"]["resourceName"].rsplit('/', 1)[-1]
+            self.findings_by_resource[resource_name].append(f['finding'])
 
     def process_resource(self, resource):
-        if not resource.get(self.annotation_key):
-            resource_name = resource[self.manager.resource_type.name]
-            resource[self.annotation_key] = self.findings_by_resource.get(resource_name, [])
+        findings = resource.get(self.annotation_key)
+        if not findings:
+            findings = self.findings_by_resource.get(resource[self._name_attr], [])
 
         if self.data.get('key'):
-            resource[self.annotation_key] = [
-                finding for finding in resource[self.annotation_key] if self.match(finding)]
-        return len(resource[self.annotation_key]) > 0
+            findings = [finding for finding in findings if self.match(finding)]
+        resource[self.annotation_key] = findings
+        return len(findings) > 0
 
     @classmethod
     def register_resources(klass, registry, resource_class):
@@ -190,6 +190,8 @@ class QueryResourceManager(ResourceManager, metaclass=QueryMeta):
         q = query or self.get_resource_query()
         key = self.get_cache_key(q)
         resources = self._fetch_resources(q)
+        # load first so saving doesn't drop entries cached by earlier runs
+        self._cache.load()
         self._cache.save(key, resources)
 
         resource_count = len(resources)
@@ -1,7 +1,11 @@
 # Copyright The Cloud Custodian Authors.
 # SPDX-License-Identifier: Apache-2.0
+import time
+
 from gcp_common import BaseTest
-from c7n_gcp.filters.metrics import GCPMetricsFilter
+from c7n.executor import MainThreadExecutor
+from c7n_gcp.filters import metrics
+from c7n_gcp.filters.metrics import GCPMetricsFilter, ALIGNERS, REDUCERS
 
 
 class TestGCPMetricsFilter(BaseTest):
@@ -57,6 +61,113 @@ class TestGCPMetricsFilter(BaseTest):
         resources = p.run()
         self.assertEqual(len(resources), 0)
 
+    def test_metrics_cached(self):
+        session_factory = self.replay_flight_data("filter-metrics-cached")
+
+        p = self.load_policy(
+            {
+                "name": "test-metrics",
+                "resource": "gcp.instance",
+                "filters": [
+                    {'type': 'metrics',
+                    'name': 'compute.googleapis.com/instance/cpu/utilization',
+                    'metric-key': 'metric.labels.instance_name',
+                    'resource-key': 'name',
+                    'aligner': 'ALIGN_MEAN',
+                    'days': 14,
+                    'value': .1,
+                    'filter': ' resource.labels.zone = "us-east4-c"',
+                    'op': 'less-than'}],
+            },
+            session_factory=session_factory,
+            cache=True,
+        )
+        # The flight only has a single timeSeries response. The second
+        # run must be served from the cached time series.
+        self.assertEqual(len(p.run()), 1)
+        resources = p.run()
+        self.assertEqual(len(resources), 1)
+        metric_name = 'compute.googleapis.com/instance/cpu/utilization.ALIGN_MEAN.REDUCE_NONE'
+        self.assertIn(metric_name, resources[0]['c7n.metrics'])
+
+    def test_metrics_cache_expiry(self):
+        p = self.load_policy(
+            {
+                "name": "test-metrics",
+                "resource": "gcp.instance",
+                "filters": [
+                    {'type': 'metrics',
+                    'name': 'compute.googleapis.com/instance/cpu/utilization',
+                    'metric-key': 'metric.labels.instance_name',
+                    'value': .1,
+                    'op': 'less-than'}],
+            },
+            cache=True,
+        )
+        metric_filter = p.resource_manager.filters[0]
+        metric_filter.process([])
+        cache_key = metric_filter.get_cache_key('cloud-custodian', ['batch'])
+
+        p.resource_manager._cache.save(cache_key, (time.time() - 301 * 60, [[]]))
+        self.assertIsNone(metric_filter.get_cached_time_series(cache_key))
+
+        p.resource_manager._cache.save(cache_key, (time.time(), [[]]))
+        self.assertEqual(metric_filter.get_cached_time_series(cache_key), [[]])
+
+    def test_metrics_multiple_batches(self):
+        session_factory = self.replay_flight_data("filter-metrics-batched")
+        self.patch(metrics, 'BATCH_SIZE', 1)
+        self.patch(GCPMetricsFilter, 'executor_factory', MainThreadExecutor)
+
+        p = self.load_policy(
+            {
+                "name": "test-metrics",
+                "resource": "gcp.instance",
+                "filters": [
+                    {'type': 'metrics',
+                    'name': 'compute.googleapis.com/instance/cpu/utilization',
+                    'metric-key': 'metric.labels.instance_name',
+                    'resource-key': 'name',
+                    'aligner': 'ALIGN_MEAN',
+                    'value': .1,
+                    'op': 'less-than'}],
+            },
+            session_factory=session_factory,
+        )
+        metric_filter = p.resource_manager.filters[0]
+        resources = metric_filter.process([{'name': 'instance-a'}, {'name': 'instance-b'}])
+
+        metric_name = 'compute.googleapis.com/instance/cpu/utilization.ALIGN_MEAN.REDUCE_NONE'
+        self.assertEqual([r['name'] for r in resources], ['instance-a', 'instance-b'])
+        self.assertEqual(
+            [r['c7n.metrics'][metric_name]['points'][0]['value']['doubleValue']
+             for r in resources],
+            [0.02, 0.03])
+
+    def test_metrics_paged(self):
+        session_factory = self.replay_flight_data("filter-metrics-paged")
+
+        p = self.load_policy(
+            {
+                "name": "test-metrics",
+                "resource": "gcp.instance",
+                "filters": [
+                    {'type': 'metrics',
+                    'name': 'compute.googleapis.com/instance/cpu/utilization',
+                    'metric-key': 'metric.labels.instance_name',
+                    'resource-key': 'name',
+                    'aligner': 'ALIGN_MEAN',
+                    'value': .1,
+                    'op': 'less-than'}],
+            },
+            session_factory=session_factory,
+        )
+        metric_filter = p.resource_manager.filters[0]
+        resources = metric_filter.process(
+            [{'name': 'instance-a'}, {'name': 'instance-b'}, {'name': 'instance-c'}])
+
+        self.assertEqual([r['name'] for r in resources], ['instance-a', 'instance-b'])
+
     def test_batch_resources(self):
         policy = self.load_policy({
             "name": "test_batch_resources",
@@ -70,8 +181,8 @@ class TestGCPMetricsFilter(BaseTest):
                     'filter': ' resource.labels.zone = "us-east4-d"',
                     'op': 'less-than'}, manager=policy.resource_manager)
         resources = [{
-            "name": "test_very_long_name"
-        }] * 300
+            "name": "test_very_long_name_%d" % i
+        } for i in range(300)]
         metric_filter.process([])
         batch = metric_filter.get_batched_query_filter(resources)
 
@@ -82,6 +193,77 @@ class TestGCPMetricsFilter(BaseTest):
         self.assertIn('resource.labels.zone = "us-east4-d"', batch[1])
         self.assertIn('metric.type = "compute.googleapis.com/instance/cpu/utilization"', batch[1])
 
+    def test_batch_resources_dedupe(self):
+        policy = self.load_policy({
+            "name": "test_batch_resources",
+            "resource": "gcp.instance"})
+
+        metric_filter = GCPMetricsFilter({'type': 'metrics',
+                    'name': 'compute.googleapis.com/instance/cpu/utilization',
+                    'metric-key': 'metric.labels.instance_name',
+                    'resource-key': 'name',
+                    'value': .1,
+                    'op': 'less-than'}, manager=policy.resource_manager)
+        resources = [{"name": "test_very_long_name"}] * 300 + [{"id": "nameless"}]
+        metric_filter.process([])
+        batch = metric_filter.get_batched_query_filter(resources)
+
+        self.assertEqual(batch, [
+            'metric.type = "compute.googleapis.com/instance/cpu/utilization" AND ( '
+            'metric.labels.instance_name = "test_very_long_name" ) '])
+
+    def get_matcher(self, resource_metric_dict, **data):
+        policy = self.load_policy({
+            "name": "test-metrics-matcher",
+            "resource": "gcp.instance"})
+        metric_filter = GCPMetricsFilter(dict({
+            'type': 'metrics',
+            'name': 'compute.googleapis.com/instance/cpu/utilization',
+            'metric-key': 'metric.labels.instance_name',
+            'resource-key': 'name',
+            'value': .1,
+            'op': 'less-than'}, **data), manager=policy.resource_manager)
+        metric_filter.process([])
+        metric_filter.resource_metric_dict = resource_metric_dict
+        return metric_filter._make_matcher()
+
+    def test_missing_value(self):
+        resource = {'name': 'no-metrics'}
+        match = self.get_matcher({}, **{'missing-value': 1, 'op': 'greater-than'})
+        self.assertTrue(match(resource))
+        self.assertNotIn('c7n.metrics', resource)
+
+        match = self.get_matcher({}, **{'missing-value': 1, 'op': 'less-than'})
+        self.assertFalse(match(resource))
+        self.assertNotIn('c7n.metrics', resource)
+
+        match = self.get_matcher({}, op='less-than')
+        self.assertFalse(match(resource))
+        self.assertNotIn('c7n.metrics', resource)
+
+    def test_point_value_types(self):
+        metric_name = 'compute.googleapis.com/instance/cpu/utilization.ALIGN_NONE.REDUCE_NONE'
+        double_metric = {'points': [{'value': {'doubleValue': 0.05}}]}
+        int64_metric = {'points': [{'value': {'int64Value': '42'}}]}
+        match = self.get_matcher(
+            {'double': double_metric, 'int64': int64_metric},
+            value=40, op='greater-than')
+
+        double_resource = {'name': 'double'}
+        self.assertFalse(match(double_resource))
+        self.assertEqual(double_resource['c7n.metrics'][metric_name], double_metric)
+
+        int64_resource = {'name': 'int64'}
+        self.assertTrue(match(int64_resource))
+        self.assertEqual(int64_resource['c7n.metrics'][metric_name], int64_metric)
+
+    def test_aggregation_enums(self):
+        self.assertEqual(len(set(REDUCERS)), len(REDUCERS))
+        self.assertEqual(len(set(ALIGNERS)), len(ALIGNERS))
+        self.assertTrue(all(r.startswith('REDUCE_') for r in REDUCERS))
+        self.assertTrue(all(a.startswith('ALIGN_') for a in ALIGNERS))
+        self.assertIn('ALIGN_PERCENT_CHANGE', ALIGNERS)
+
 
 class TestSecurityComandCenterFindingsFilter(BaseTest):
 
@@ -122,3 +304,38 @@ class TestSecurityComandCenterFindingsFilter(BaseTest):
         )
         resources = p.run()
         self.assertEqual(len(resources), 1)
+
+    def test_findings_cached(self):
+
+        session_factory = self.replay_flight_data("filter-scc-findings-cached")
+
+        p = self.load_policy(
+            {
+                "name": "test-scc-findings",
+                "resource": "gcp.bucket",
+                "filters": [
+                    {'type': 'scc-findings',
+                     'org': 111111111111,
+                     'key': 'category',
+                     'value': 'BUCKET_LOGGING_DISABLED'}],
+            },
+            session_factory=session_factory,
+            cache=True,
+        )
+        # A single findings response, so the second run must hit the cache.
+        self.assertEqual(len(p.run()), 1)
+        resources = p.run()
+        self.assertEqual(len(resources), 1)
+        self.assertEqual(resources[0]['c7n:matched-findings'][0]['category'],
+          'BUCKET_LOGGING_DISABLED')
+
+    def test_findings_no_resources(self):
+        p = self.load_policy(
+            {
+                "name": "test-scc-findings",
+                "resource": "gcp.bucket",
+                "filters": [
+                    {'type': 'scc-findings',
+                     'org': 111111111111}],
+            })
+        self.assertEqual(p.resource_manager.filters[0].process([]), [])